@@ -0,0 +1,360 @@
+# bench_media.py - micro-benchmarks for the media pipeline in terabox.py
+#
+# Generates synthetic videos locally with ffmpeg (no network, no Telegram)
+# and times probing, ffmpeg splitting, byte-range splitting, fingerprinting
+# and filename cleaning. Results are written as JSON so runs on different
+# commits can be compared:
+#
+#   python bench_media.py --out before.json
+#   git checkout <other commit>
+#   python bench_media.py --out after.json --compare before.json
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# terabox.py exits without these; the benchmark never connects anywhere.
+for _key, _value in {
+    "TELEGRAM_API": "1",
+    "TELEGRAM_HASH": "bench",
+    "BOT_TOKEN": "1:bench",
+    "DUMP_CHAT_ID": "-1001",
+    "FSUB_ID": "-1001",
+}.items():
+    os.environ.setdefault(_key, _value)
+os.environ.setdefault("FFMPEG_BIN", "ffmpeg")
+
+import terabox  # noqa: E402
+
+# (duration seconds, video bitrate, keyframe interval in frames)
+PROFILES = {
+    "quick": {
+        "containers": ["mp4", "mkv", "webm"],
+        "durations": [10],
+        "bitrates": ["1M", "4M"],
+        "gops": [25, 250],
+    },
+    "full": {
+        "containers": ["mp4", "mkv", "webm"],
+        "durations": [10, 60],
+        "bitrates": ["1M", "4M", "8M"],
+        "gops": [12, 50, 250],
+    },
+}
+
+CODECS = {
+    "mp4": ["-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac"],
+    "mkv": ["-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac"],
+    "webm": ["-c:v", "libvpx", "-deadline", "realtime", "-cpu-used", "8", "-c:a", "libopus"],
+}
+
+# Read size for split_file_by_bytes.
+BYTE_SPLIT_BLOCK = 4 * 1024 * 1024
+
+NAME_SAMPLES = [
+    "Movie.Name.2023.1080p.mp4.mkv",
+    "https://d.terabox.app/file/abc%20def%5B1%5D.mp4?fid=123&sign=xyz",
+    "%E6%B5%8B%E8%AF%95%E8%A7%86%E9%A2%91.mkv",
+    "plain_file.webm",
+    "x" * 300 + ".mp4",
+]
+
+
+def timed(fn, *args, repeat: int = 1):
+    """Run fn `repeat` times; return (last result, list of seconds)."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - t0)
+    return result, times
+
+
+def summarize(times: list[float]) -> dict:
+    return {
+        "min_s": round(min(times), 6),
+        "median_s": round(statistics.median(times), 6),
+        "runs": len(times),
+    }
+
+
+def tool_version(binary: str) -> str:
+    try:
+        out = subprocess.run([binary, "-version"], capture_output=True, text=True)
+        return out.stdout.splitlines()[0]
+    except Exception:
+        return "unavailable"
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        return out.stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+
+def generate_video(path: str, container: str, duration: int, bitrate: str, gop: int):
+    cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        *CODECS[container],
+        "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate,
+        "-g", str(gop), "-keyint_min", str(gop),
+        "-shortest", path,
+    ]
+    subprocess.run(cmd, check=True)
+
+
+class SubprocessCounter:
+    """Counts ffmpeg/ffprobe processes spawned through asyncio (= passes over the file)."""
+
+    def __init__(self):
+        self.count = 0
+        self._orig = asyncio.create_subprocess_exec
+
+    async def _wrapped(self, *args, **kwargs):
+        self.count += 1
+        return await self._orig(*args, **kwargs)
+
+    def __enter__(self):
+        asyncio.create_subprocess_exec = self._wrapped
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.create_subprocess_exec = self._orig
+
+
+def split_file_by_bytes(input_path: str, output_prefix: str, split_size: int) -> list[str]:
+    """
+    Split any file into raw byte ranges of <= split_size, named
+    <output_prefix><ext>.001, .002, ... (rejoin with `cat`).
+    Baseline for terabox.split_video_with_ffmpeg; the bot never uses it.
+    """
+    original_ext = os.path.splitext(input_path)[1]
+    parts = math.ceil(os.path.getsize(input_path) / split_size)
+    if parts <= 1:
+        return [input_path]
+
+    split_files = []
+    with open(input_path, "rb") as src:
+        for i in range(parts):
+            output_path = f"{output_prefix}{original_ext}.{i+1:03d}"
+            remaining = split_size
+            with open(output_path, "wb") as dst:
+                while remaining > 0:
+                    block = src.read(min(BYTE_SPLIT_BLOCK, remaining))
+                    if not block:
+                        break
+                    dst.write(block)
+                    remaining -= len(block)
+            split_files.append(output_path)
+    return split_files
+
+
+def part_stats(parts: list[str], split_size: int) -> dict:
+    sizes = [os.path.getsize(p) for p in parts]
+    return {
+        "parts": len(parts),
+        "part_sizes": sizes,
+        "split_size": split_size,
+        "mean_ratio": round(statistics.mean(sizes) / split_size, 4),
+        "stdev_ratio": round(statistics.pstdev(sizes) / split_size, 4),
+        "max_ratio": round(max(sizes) / split_size, 4),
+        # Parts above split_size would be rejected by Telegram
+        "oversize_parts": sum(1 for s in sizes if s > split_size),
+    }
+
+
+def remove_parts(parts: list[str], keep: str):
+    for p in parts:
+        if p != keep and os.path.exists(p):
+            os.remove(p)
+
+
+def bench_video(workdir: str, spec: dict, target_parts: int, repeat: int) -> dict:
+    name = "bench_{container}_{duration}s_{bitrate}_g{gop}.{container}".format(**spec)
+    path = os.path.join(workdir, name)
+    generate_video(path, spec["container"], spec["duration"], spec["bitrate"], spec["gop"])
+    size = os.path.getsize(path)
+    split_size = size // target_parts + 1
+    result = {"spec": spec, "file": name, "size": size}
+
+    # Probing
+    _, times = timed(lambda: asyncio.run(terabox.probe_duration(path)), repeat=repeat)
+    result["probe"] = summarize(times)
+
+    # ffmpeg splitting (time-based, stream copy)
+    prefix = os.path.join(workdir, "split_" + os.path.splitext(name)[0])
+    split_times, passes, parts = [], 0, []
+    for _ in range(repeat):
+        with SubprocessCounter() as counter:
+            t0 = time.perf_counter()
+            parts = asyncio.run(terabox.split_video_with_ffmpeg(path, prefix, split_size))
+            split_times.append(time.perf_counter() - t0)
+        passes = counter.count
+        stats = part_stats(parts, split_size)
+        remove_parts(parts, keep=path)
+    result["split"] = {**summarize(split_times), "passes": passes, **stats}
+
+    # Byte-range splitting
+    byte_times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        parts = split_file_by_bytes(path, prefix, split_size)
+        byte_times.append(time.perf_counter() - t0)
+        stats = part_stats(parts, split_size)
+        remove_parts(parts, keep=path)
+    result["byte_split"] = {**summarize(byte_times), **stats}
+
+    # Fingerprinting: full hash, and head/tail partial hash. The real 8 MB
+    # chunk covers most of these files, so scale it down to 1/16 of the file.
+    orig_min = terabox.FINGERPRINT_PARTIAL_MIN_SIZE
+    orig_chunk = terabox.FINGERPRINT_PARTIAL_CHUNK
+    chunk = max(size // 16, 64 * 1024)
+    try:
+        terabox.FINGERPRINT_PARTIAL_MIN_SIZE = 0
+        _, full_times = timed(terabox.compute_fingerprint, path, repeat=repeat)
+        terabox.FINGERPRINT_PARTIAL_MIN_SIZE = 1
+        terabox.FINGERPRINT_PARTIAL_CHUNK = chunk
+        _, partial_times = timed(terabox.compute_fingerprint, path, repeat=repeat)
+    finally:
+        terabox.FINGERPRINT_PARTIAL_MIN_SIZE = orig_min
+        terabox.FINGERPRINT_PARTIAL_CHUNK = orig_chunk
+    result["fingerprint_full"] = {
+        **summarize(full_times),
+        "mb_per_s": round(size / min(full_times) / 1024 / 1024, 1),
+    }
+    result["fingerprint_partial"] = {
+        **summarize(partial_times),
+        "chunk_bytes": chunk,
+        "hashed_bytes": min(2 * chunk, size),
+    }
+
+    os.remove(path)
+    return result
+
+
+def bench_naming(workdir: str, iterations: int) -> dict:
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        for sample in NAME_SAMPLES:
+            terabox.clean_download_name(sample)
+    clean_s = time.perf_counter() - t0
+
+    # normalize_download_path renames on disk, so recreate the file each run
+    dirty = os.path.join(workdir, "Movie.Name.2023.1080p.mp4.mkv")
+    rename_times = []
+    for _ in range(min(iterations, 200)):
+        open(dirty, "wb").close()
+        t0 = time.perf_counter()
+        new_path, _ = terabox.normalize_download_path(dirty)
+        rename_times.append(time.perf_counter() - t0)
+        os.remove(new_path)
+
+    return {
+        "clean_download_name": {
+            "calls": iterations * len(NAME_SAMPLES),
+            "us_per_call": round(clean_s / (iterations * len(NAME_SAMPLES)) * 1e6, 3),
+        },
+        "normalize_download_path": summarize(rename_times),
+    }
+
+
+def flatten(results: dict) -> dict:
+    """metric path -> seconds, for the timing fields that are compared across runs."""
+    flat = {}
+    for key, value in results.get("naming", {}).items():
+        for metric in ("median_s", "us_per_call"):
+            if metric in value:
+                flat[f"naming.{key}.{metric}"] = value[metric]
+    for video in results.get("videos", []):
+        for stage in ("probe", "split", "byte_split", "fingerprint_full", "fingerprint_partial"):
+            if stage in video:
+                flat[f"{video['file']}.{stage}.median_s"] = video[stage]["median_s"]
+    return flat
+
+
+def compare(old_path: str, new: dict):
+    with open(old_path, "r") as f:
+        old = json.load(f)
+    old_flat, new_flat = flatten(old), flatten(new)
+    print(f"\nCompared with {old_path} ({old['meta']['commit']} -> {new['meta']['commit']}):")
+    for key in sorted(new_flat):
+        if key in old_flat and old_flat[key]:
+            ratio = new_flat[key] / old_flat[key]
+            print(f"  {key:70s} {old_flat[key]:>10.5f} -> {new_flat[key]:>10.5f}  x{ratio:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Media pipeline micro-benchmarks")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--parts", type=int, default=3,
+                        help="split each video into this many parts (sets split_size)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--name-iterations", type=int, default=2000)
+    parser.add_argument("--out", default="bench_media.json")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--workdir", help="where to generate videos (default: temp dir)")
+    args = parser.parse_args()
+
+    for binary in ("ffmpeg", "ffprobe", terabox.FFMPEG_BIN):
+        if not shutil.which(binary):
+            print(f"{binary} not found in PATH", file=sys.stderr)
+            raise SystemExit(1)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_media_")
+    os.makedirs(workdir, exist_ok=True)
+    profile = PROFILES[args.profile]
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "profile": args.profile,
+            "parts": args.parts,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "ffmpeg": tool_version("ffmpeg"),
+        },
+        "naming": bench_naming(workdir, args.name_iterations),
+        "videos": [],
+    }
+
+    specs = itertools.product(
+        profile["containers"], profile["durations"], profile["bitrates"], profile["gops"]
+    )
+    try:
+        for container, duration, bitrate, gop in specs:
+            spec = {"container": container, "duration": duration, "bitrate": bitrate, "gop": gop}
+            print(f"[bench] {spec}", flush=True)
+            results["videos"].append(bench_video(workdir, spec, args.parts, args.repeat))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[bench] Wrote {args.out}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,8 +27,8 @@ else
   echo "[start.sh] WARNING: aria2c not found in PATH"
 fi
 
-# give aria2 a moment to come online
-sleep 2
+# No fixed sleep: terabox.py polls aria2's RPC until it answers
+# (ARIA2_READY_TIMEOUT) while the Telegram clients start in parallel.
 
 # Exec the bot (PID 1 will be python process)
 exec python3 terabox.py
@@ -1,25 +1,35 @@
+import time
+STARTUP_T0 = time.perf_counter()
+
 from aria2p import API as Aria2API, Client as Aria2Client
 import asyncio
-from datetime import datetime
+from collections import Counter
+import hashlib
+import io
+import json
 import os
 import logging
 import math
-import time
+import re
+import sqlite3
 import urllib.parse
 from urllib.parse import urlparse, unquote
 
-import requests
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.types import (
     Message,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQuery,
+    InlineQueryResultCachedAudio,
+    InlineQueryResultCachedDocument,
+    InlineQueryResultCachedPhoto,
+    InlineQueryResultCachedVideo,
 )
 from pyrogram.enums import ChatMemberStatus
 from pyrogram.errors import FloodWait, RPCError
-
-from flask import Flask, render_template
-from threading import Thread
+from contextlib import asynccontextmanager
+from threading import Lock, Thread
 
 # -------------------------------------------------
 # Pyrogram ID limits fix (for very large negative IDs)
@@ -44,6 +54,11 @@ logging.getLogger("pyrogram.session").setLevel(logging.ERROR)
 logging.getLogger("pyrogram.connection").setLevel(logging.ERROR)
 logging.getLogger("pyrogram.dispatcher").setLevel(logging.ERROR)
 
+# Startup-time breakdown (seconds), reported in logs and on /health.
+# requests / flask are imported lazily to keep them off the boot path.
+STARTUP_TIMINGS: dict[str, float] = {"imports": round(time.perf_counter() - STARTUP_T0, 3)}
+STARTUP_STATE = {"ready": False, "aria2_ready": False}
+
 # -------------------------------------------------
 # aria2 RPC
 # -------------------------------------------------
@@ -63,10 +78,36 @@ ARIA2_OPTS = {
     "min-split-size": "4M",
     "split": "10"
 }
-try:
-    aria2.set_global_options(ARIA2_OPTS)
-except Exception as e:
-    logger.error(f"Failed to set aria2 global options: {e}")
+# How long startup waits for aria2's RPC to answer before going on
+# without it (polling then continues in the background).
+ARIA2_READY_TIMEOUT = float(os.environ.get("ARIA2_READY_TIMEOUT", "15"))
+# Set once aria2 answers; downloads wait on it instead of racing startup.
+ARIA2_READY = asyncio.Event()
+
+
+async def wait_for_aria2(timeout: float | None) -> bool:
+    """
+    Poll aria2 until its RPC answers, then apply ARIA2_OPTS.
+    Backs off from 0.1s to 2s between tries; `timeout=None` waits forever.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.1
+    last_error = None
+    while True:
+        try:
+            await asyncio.to_thread(aria2.client.get_version)
+            await asyncio.to_thread(aria2.set_global_options, ARIA2_OPTS)
+            STARTUP_STATE["aria2_ready"] = True
+            ARIA2_READY.set()
+            logger.info("aria2 is up, global options applied.")
+            return True
+        except Exception as e:
+            last_error = e
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.error(f"aria2 not ready after {timeout:g}s ({last_error}), still waiting in background")
+            return False
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 2.0)
 
 # -------------------------------------------------
 # Supported domains text (for error message)
@@ -185,6 +226,123 @@ TERA_API_BASE = os.environ.get(
     "https://teradl.tiiny.io/"
 )
 
+# -------------------------------------------------
+# Local store / inline mode settings
+# -------------------------------------------------
+LOCAL_DB_PATH = os.environ.get("LOCAL_DB_PATH", "jetbot.db")
+INLINE_RESULTS_LIMIT = min(int(os.environ.get("INLINE_RESULTS_LIMIT", "50")), 50)
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "30"))
+# The history scan stops after this many consecutive batches of
+# message IDs come back empty (end of channel, or a large gap).
+INDEX_SCAN_BATCH = 200
+INDEX_SCAN_MAX_EMPTY = int(os.environ.get("INDEX_SCAN_MAX_EMPTY", "5"))
+
+# -------------------------------------------------
+# Content fingerprint (dedup across share links)
+# -------------------------------------------------
+# Files at least this big are fingerprinted by size + head/tail chunks
+# instead of a full hash (0 = always hash the whole file).
+FINGERPRINT_PARTIAL_MIN_SIZE = int(os.environ.get("FINGERPRINT_PARTIAL_MIN_MB", "0")) * 1024 * 1024
+FINGERPRINT_PARTIAL_CHUNK = 8 * 1024 * 1024
+FINGERPRINT_BLOCK = 1024 * 1024
+
+# -------------------------------------------------
+# Rate limits (per user)
+# -------------------------------------------------
+def _parse_id_list(raw: str) -> set[int]:
+    ids = set()
+    for part in raw.replace(",", " ").split():
+        try:
+            ids.add(int(part))
+        except ValueError:
+            logger.error(f"Ignoring invalid user ID in list: {part}")
+    return ids
+
+
+def _parse_limit_overrides(raw: str) -> dict[int, dict]:
+    """
+    RATE_LIMIT_OVERRIDES="12345:rpm=10:jobs=4:quota_gb=50,67890:jobs=1"
+    """
+    overrides = {}
+    for entry in raw.replace(";", ",").split(","):
+        fields = entry.strip().split(":")
+        if not fields[0]:
+            continue
+        try:
+            uid = int(fields[0])
+            limits = {}
+            for field in fields[1:]:
+                key, value = field.split("=", 1)
+                limits[key.strip()] = float(value)
+            overrides[uid] = limits
+        except ValueError:
+            logger.error(f"Ignoring invalid RATE_LIMIT_OVERRIDES entry: {entry}")
+    return overrides
+
+
+ADMIN_IDS = _parse_id_list(os.environ.get("ADMIN_IDS", ""))
+RATE_LIMIT_EXEMPT_IDS = _parse_id_list(os.environ.get("RATE_LIMIT_EXEMPT_IDS", ""))
+RATE_LIMIT_OVERRIDES = _parse_limit_overrides(os.environ.get("RATE_LIMIT_OVERRIDES", ""))
+# 0 disables the corresponding limit.
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", "0"))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "3"))
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", "0"))
+DAILY_QUOTA_GB = float(os.environ.get("DAILY_QUOTA_GB", "0"))
+# Optional JSON file so daily usage and admin overrides survive restarts.
+RATE_LIMIT_STATE_FILE = os.environ.get("RATE_LIMIT_STATE_FILE", "")
+
+# -------------------------------------------------
+# Splitting (ffmpeg)
+# -------------------------------------------------
+# ffmpeg binary used for splitting (the deploy image ships it as "xtra").
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "xtra")
+
+# -------------------------------------------------
+# Progress / status messages
+# -------------------------------------------------
+# Minimum seconds between edits of a job's status message.
+STATUS_UPDATE_INTERVAL = float(os.environ.get("STATUS_UPDATE_INTERVAL", "10"))
+DOWNLOAD_POLL_INTERVAL = 2
+# Speed is sampled at most once per SPEED_SAMPLE_INTERVAL seconds and
+# smoothed with an EWMA of weight SPEED_EWMA_ALPHA for the newest sample.
+SPEED_SAMPLE_INTERVAL = 1.0
+SPEED_EWMA_ALPHA = 0.3
+
+# -------------------------------------------------
+# Bandwidth allocation (shortest-remaining-first with aging)
+# -------------------------------------------------
+# Seconds between aria2 rebalances (0 disables the manager).
+BANDWIDTH_REBALANCE_INTERVAL = float(os.environ.get("BANDWIDTH_REBALANCE_INTERVAL", "3"))
+# Share of the measured link speed kept for the job closest to finishing.
+BANDWIDTH_PRIORITY_SHARE = float(os.environ.get("BANDWIDTH_PRIORITY_SHARE", "0.6"))
+# Per-download speed floor for the other jobs, so nothing stalls (KiB/s).
+BANDWIDTH_MIN_RATE = int(os.environ.get("BANDWIDTH_MIN_RATE_KB", "256")) * 1024
+# Every BANDWIDTH_AGING_SECONDS a job has waited counts like halving its
+# remaining size, so big jobs are not starved forever.
+BANDWIDTH_AGING_SECONDS = float(os.environ.get("BANDWIDTH_AGING_SECONDS", "120"))
+# Link capacity is the best recent total speed, decayed by this factor
+# every rebalance so it can follow a slower link.
+BANDWIDTH_CAPACITY_DECAY = 0.95
+# Concurrent Telegram uploads (0 = unlimited, the scheduler is a no-op).
+UPLOAD_SLOTS = int(os.environ.get("UPLOAD_SLOTS", "0"))
+
+# -------------------------------------------------
+# In-memory fast path for small files
+# -------------------------------------------------
+# Files whose API-reported size is at most this are fetched into memory
+# and uploaded from the buffer, skipping aria2 and the disk (0 disables).
+MEMORY_FASTPATH_MAX = int(os.environ.get("MEMORY_FASTPATH_MAX_MB", "20")) * 1024 * 1024
+# Total bytes all in-memory buffers may hold at once; when it is used up,
+# small files simply take the aria2/disk path.
+MEMORY_FASTPATH_BUDGET = int(os.environ.get("MEMORY_FASTPATH_BUDGET_MB", "200")) * 1024 * 1024
+MEMORY_FASTPATH_CHUNK = 256 * 1024
+
+# -------------------------------------------------
+# Delivery (copy / cached file_id before any re-upload)
+# -------------------------------------------------
+DELIVERY_RETRIES = int(os.environ.get("DELIVERY_RETRIES", "3"))
+DELIVERY_BACKOFF = 1.0  # seconds, doubled after every failed attempt
+
 # -------------------------------------------------
 # Helpers
 # -------------------------------------------------
@@ -206,6 +364,15 @@ def format_size(size: int) -> str:
     return f"{size / (1024 * 1024 * 1024):.2f} GB"
 
 
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}h {minutes}m {secs}s"
+    return f"{minutes}m {secs}s"
+
+
 def is_probably_media_url(u: str) -> bool:
     if not isinstance(u, str):
         return False
@@ -289,7 +456,24 @@ def pick_media_url_from_api(data: dict, original_url: str) -> str | None:
     return unique[0]
 
 
-def call_tera_api(share_url: str) -> tuple[str | None, bool]:
+def parse_size(value) -> int:
+    """Parse an API size like 1048576, "512 MB" or "1.2GiB" into bytes (0 if unknown)."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, str):
+        return 0
+    m = re.match(r"^\s*([\d.]+)\s*([KMGT]?)I?B?\s*$", value.upper())
+    if not m:
+        return 0
+    try:
+        number = float(m.group(1))
+    except ValueError:
+        return 0
+    multiplier = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    return int(number * multiplier[m.group(2)])
+
+
+def call_tera_api(share_url: str) -> tuple[str | None, int, bool]:
     """
     Call NEW terabox API:
       https://teradl.tiiny.io/?key=RushVx&link={link}
@@ -306,9 +490,11 @@ def call_tera_api(share_url: str) -> tuple[str | None, bool]:
       ]
     }
 
-    Returns (media_url, True) on success,
-    or (None, False) on failure / unsupported.
+    Returns (media_url, size_bytes, True) on success (size is 0 if the
+    API did not report one), or (None, 0, False) on failure / unsupported.
     """
+    import requests
+
     try:
         encoded = urllib.parse.quote(share_url, safe="")
         api_url = f"{TERA_API_BASE}?key=RushVx&link={encoded}"
@@ -317,41 +503,41 @@ def call_tera_api(share_url: str) -> tuple[str | None, bool]:
 
         if resp.status_code != 200:
             logger.error(f"[API] Non-200 status: {resp.status_code}")
-            return None, False
+            return None, 0, False
 
         try:
             data = resp.json()
         except Exception:
             logger.error("[API] Response not JSON, treat as failure")
-            return None, False
+            return None, 0, False
 
         if not isinstance(data, dict):
             logger.error("[API] JSON root is not an object")
-            return None, False
+            return None, 0, False
 
         items = data.get("data")
         if not isinstance(items, list) or not items:
             logger.error("[API] 'data' array missing or empty")
-            return None, False
+            return None, 0, False
 
         first = items[0]
         if not isinstance(first, dict):
             logger.error("[API] First element in 'data' is not an object")
-            return None, False
+            return None, 0, False
 
         media_url = first.get("download") or first.get("url")
         if not media_url:
             logger.error("[API] 'download' field missing in first data item")
-            return None, False
+            return None, 0, False
 
         # We trust the API; don't over-filter with is_probably_media_url,
         # so images/docs/etc. also work.
         logger.info(f"[API] Picked media URL: {media_url}")
-        return media_url, True
+        return media_url, parse_size(first.get("size")), True
 
     except Exception as e:
         logger.error(f"[API] Failed to call tera API: {e}")
-        return None, False
+        return None, 0, False
 
 
 async def safe_edit(message, text):
@@ -424,6 +610,19 @@ def normalize_download_path(file_path: str) -> tuple[str, str]:
     return file_path, orig_name
 
 
+def media_size(media: str | io.BytesIO) -> int:
+    """Size of a file on disk or of an in-memory buffer."""
+    if isinstance(media, str):
+        return os.path.getsize(media)
+    return media.getbuffer().nbytes
+
+
+def media_name(media: str | io.BytesIO) -> str:
+    if isinstance(media, str):
+        return os.path.basename(media)
+    return media.name
+
+
 def get_extension(name_or_path: str) -> str:
     return os.path.splitext(name_or_path)[1].lower()
 
@@ -436,6 +635,239 @@ def is_image_ext(ext: str) -> bool:
     return ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]
 
 
+def share_key(url: str) -> str:
+    """
+    Key a share link by its share code so the same file under
+    different mirror domains (terabox.com, 1024tera.com, ...) matches.
+    Falls back to the URL without scheme/query if no code is found.
+    """
+    try:
+        parsed = urlparse(url)
+    except Exception:
+        return url
+    surl = urllib.parse.parse_qs(parsed.query).get("surl")
+    if surl:
+        return "1" + surl[0]
+    m = re.search(r"/s/([A-Za-z0-9_-]+)", parsed.path)
+    if m:
+        return m.group(1)
+    return parsed.netloc.lower() + parsed.path
+
+
+# -------------------------------------------------
+# Local store (SQLite): dump-channel index
+# -------------------------------------------------
+_db = None
+_db_lock = Lock()
+
+
+def get_db() -> sqlite3.Connection:
+    """Open the local store on first use and create tables if needed."""
+    global _db
+    with _db_lock:
+        if _db is None:
+            conn = sqlite3.connect(LOCAL_DB_PATH, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS dump_index (
+                    message_id  INTEGER PRIMARY KEY,
+                    file_id     TEXT NOT NULL,
+                    media_type  TEXT NOT NULL,
+                    title       TEXT NOT NULL,
+                    size        INTEGER NOT NULL DEFAULT 0,
+                    source_link TEXT,
+                    source_key  TEXT
+                );
+                CREATE INDEX IF NOT EXISTS dump_index_source_key
+                    ON dump_index(source_key);
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    fingerprint TEXT NOT NULL,
+                    part_index  INTEGER NOT NULL,
+                    part_count  INTEGER NOT NULL,
+                    message_id  INTEGER NOT NULL,
+                    PRIMARY KEY (fingerprint, part_index)
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key   TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                """
+            )
+            _db = conn
+        return _db
+
+
+def db_execute(sql: str, params: tuple = ()) -> list:
+    db = get_db()
+    with _db_lock:
+        rows = db.execute(sql, params).fetchall()
+        db.commit()
+        return rows
+
+
+def get_meta(key: str) -> str | None:
+    rows = db_execute("SELECT value FROM meta WHERE key = ?", (key,))
+    return rows[0][0] if rows else None
+
+
+def set_meta(key: str, value: str):
+    db_execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        (key, value)
+    )
+
+
+INDEXED_MEDIA_TYPES = ("video", "document", "audio", "photo")
+
+
+def get_message_media(msg: Message | None) -> tuple[str | None, object]:
+    """Return (media_type, media) of the first indexed media kind on `msg`."""
+    if not msg or getattr(msg, "empty", False):
+        return None, None
+    for kind in INDEXED_MEDIA_TYPES:
+        media = getattr(msg, kind, None)
+        if media:
+            return kind, media
+    return None, None
+
+
+def index_dump_message(msg: Message, source_link: str | None = None) -> bool:
+    """
+    Store (file_id, title, size, source link) of a dump-channel post.
+    `msg` must be fetched through the bot client: file_ids are per-account,
+    and inline results are answered by the bot.
+    """
+    media_type, media = get_message_media(msg)
+    if not media_type:
+        return False
+
+    caption = msg.caption or ""
+    if not source_link:
+        for word in caption.split():
+            if word.startswith("http") and is_valid_url(word):
+                source_link = word
+                break
+
+    title = getattr(media, "file_name", None)
+    if not title and caption:
+        title = caption.splitlines()[0].replace("✨", "").strip()
+    title = title or f"{media_type} {msg.id}"
+
+    try:
+        db_execute(
+            "INSERT OR REPLACE INTO dump_index "
+            "(message_id, file_id, media_type, title, size, source_link, source_key) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                msg.id,
+                media.file_id,
+                media_type,
+                title,
+                getattr(media, "file_size", 0) or 0,
+                source_link,
+                share_key(source_link) if source_link else None,
+            )
+        )
+    except Exception as e:
+        logger.error(f"[Index] Failed to index dump message {msg.id}: {e}")
+        return False
+    return True
+
+
+def search_dump_index(query: str, limit: int, offset: int = 0) -> list[tuple]:
+    """
+    Look up indexed posts by share link (any mirror domain) or by title words.
+    Returns rows of (message_id, file_id, media_type, title, size, source_link).
+    """
+    cols = "message_id, file_id, media_type, title, size, source_link"
+    query = query.strip()
+
+    if query.startswith("http://") or query.startswith("https://"):
+        return db_execute(
+            f"SELECT {cols} FROM dump_index WHERE source_key = ? "
+            "ORDER BY message_id DESC LIMIT ? OFFSET ?",
+            (share_key(query), limit, offset)
+        )
+
+    words = [
+        w.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        for w in query.split()
+    ]
+    where = " AND ".join(["title LIKE ? ESCAPE '\\'"] * len(words)) or "1"
+    params = tuple(f"%{w}%" for w in words) + (limit, offset)
+    return db_execute(
+        f"SELECT {cols} FROM dump_index WHERE {where} "
+        "ORDER BY message_id DESC LIMIT ? OFFSET ?",
+        params
+    )
+
+
+def lookup_indexed_file_id(message_id: int) -> str | None:
+    rows = db_execute("SELECT file_id FROM dump_index WHERE message_id = ?", (message_id,))
+    return rows[0][0] if rows else None
+
+
+async def index_uploaded_message(uploader: Client, sent: Message,
+                                 source_link: str) -> Message | None:
+    """
+    Index a fresh dump upload, re-fetching it via the bot if the user client
+    sent it. Returns the bot's view of the post (its file_id is the one the
+    bot can reuse), or None if it could not be fetched.
+    """
+    try:
+        if uploader is not app:
+            sent = await app.get_messages(DUMP_CHAT_ID, sent.id)
+        index_dump_message(sent, source_link)
+        return sent
+    except Exception as e:
+        logger.error(f"[Index] Could not index new dump post: {e}")
+        return None
+
+
+async def scan_dump_history():
+    """
+    Background scan of DUMP_CHAT_ID, resumable from the last indexed message.
+    Bots cannot read chat history, so this walks message IDs in batches
+    with get_messages until INDEX_SCAN_MAX_EMPTY batches in a row are empty.
+    """
+    cursor = int(get_meta("scan_cursor") or 0)
+    probe = cursor
+    empty_runs = 0
+    indexed = 0
+    logger.info(f"[Index] History scan started from message {cursor + 1}")
+
+    while empty_runs < INDEX_SCAN_MAX_EMPTY:
+        ids = list(range(probe + 1, probe + 1 + INDEX_SCAN_BATCH))
+        try:
+            msgs = await app.get_messages(DUMP_CHAT_ID, ids)
+        except FloodWait as e:
+            await asyncio.sleep(e.value)
+            continue
+        except Exception as e:
+            logger.error(f"[Index] History scan aborted: {e}")
+            return
+
+        found = False
+        for m in msgs:
+            if not m or m.empty:
+                continue
+            found = True
+            cursor = max(cursor, m.id)
+            if index_dump_message(m):
+                indexed += 1
+
+        probe = ids[-1]
+        if found:
+            empty_runs = 0
+            set_meta("scan_cursor", str(cursor))
+        else:
+            empty_runs += 1
+        await asyncio.sleep(1)
+
+    logger.info(f"[Index] History scan finished: {indexed} posts indexed, last message {cursor}")
+
+
 # -------------------------------------------------
 # Bot commands
 # -------------------------------------------------
@@ -467,6 +899,47 @@ async def start_command(client: Client, message: Message):
         await message.reply_text(final_msg, reply_markup=reply_markup)
 
 
+@app.on_message(filters.command("setlimit") & filters.private)
+async def setlimit_command(client: Client, message: Message):
+    """
+    Admin only:
+      /setlimit <user_id> rpm=10 jobs=3 quota_gb=20
+      /setlimit <user_id> exempt
+      /setlimit <user_id> reset
+    """
+    if not message.from_user or message.from_user.id not in ADMIN_IDS:
+        return
+
+    args = message.command[1:]
+    try:
+        uid = int(args[0])
+        limits = {}
+        for arg in args[1:]:
+            if arg == "reset":
+                limits = {}
+                break
+            if arg == "exempt":
+                limits["exempt"] = 1
+                continue
+            key, value = arg.split("=", 1)
+            if key not in ("rpm", "jobs", "quota_gb"):
+                raise ValueError(key)
+            limits[key] = float(value)
+    except (IndexError, ValueError):
+        await message.reply_text(
+            "Usage: /setlimit <user_id> [rpm=N] [jobs=N] [quota_gb=N] [exempt] | reset"
+        )
+        return
+
+    rate_limiter.set_override(uid, limits)
+    rpm, jobs, quota = rate_limiter.limits_for(uid)
+    await message.reply_text(
+        f"✅ Limits for {uid}: "
+        + ("exempt" if rate_limiter.is_exempt(uid) else
+           f"{rpm:g}/min, {jobs} job(s), {format_size(quota) if quota else 'no'} daily quota")
+    )
+
+
 # -------------------------------------------------
 # Main handler (all non-command text in private)
 # -------------------------------------------------
@@ -509,177 +982,97 @@ async def handle_message(client: Client, message: Message):
         await message.reply_text(SUPPORTED_DOMAINS_TEXT)
         return
 
-    status_message = await message.reply_text("sᴇɴᴅɪɴɢ ʏᴏᴜ ᴛʜᴇ ᴍᴇᴅɪᴀ...🤤")
-
-    # 1) Call NEW API
-    media_url, ok = call_tera_api(url)
-    if not ok or not media_url:
-        await safe_edit(status_message, SUPPORTED_DOMAINS_TEXT)
+    # Per-user rate limits (requests/min, concurrent jobs, daily quota)
+    rejection = rate_limiter.acquire(user_id)
+    if rejection:
+        await message.reply_text(rejection)
         return
 
-    # 2) Add to aria2
     try:
-        download = aria2.add_uris([media_url])
-    except Exception as e:
-        logger.error(f"aria2.add_uris failed: {e}")
-        await safe_edit(status_message, f"❌ Failed to start download:\n`{e}`")
-        return
+        await process_link(message, user_id, url)
+    finally:
+        rate_limiter.release(user_id)
 
-    start_time = datetime.now()
 
-    # 3) Poll download
-    while True:
-        await asyncio.sleep(5)
-        try:
-            download.update()
-        except Exception as e:
-            logger.error(f"Download update failed: {e}")
-            break
+async def process_link(message: Message, user_id: int, url: str):
+    status_message = await message.reply_text("sᴇɴᴅɪɴɢ ʏᴏᴜ ᴛʜᴇ ᴍᴇᴅɪᴀ...🤤")
 
-        if download.is_complete:
-            break
+    # 1) Call NEW API
+    media_url, api_size, ok = call_tera_api(url)
+    if not ok or not media_url:
+        await safe_edit(status_message, SUPPORTED_DOMAINS_TEXT)
+        return
 
-        if download.is_removed or download.status == "error":
-            logger.error(f"Download failed/removed. Status={download.status}")
-            await safe_edit(status_message, "❌ Download failed or was removed.")
+    # Reject early if the reported size alone would exceed the daily quota
+    if api_size:
+        quota_error = rate_limiter.check_quota(user_id, api_size)
+        if quota_error:
+            await safe_edit(status_message, quota_error)
             return
 
-        total = download.total_length or 0
-        completed = download.completed_length or 0
-        progress = completed * 100 / total if total > 0 else 0.0
-
-        elapsed_time = datetime.now() - start_time
-        elapsed_minutes, elapsed_seconds = divmod(elapsed_time.seconds, 60)
-
-        bar_filled = int(progress / 10)
-        bar = "★" * bar_filled + "☆" * (10 - bar_filled)
-
-        status_text = (
-            f"┏ ғɪʟᴇɴᴀᴍᴇ: {download.name or 'Unknown'}\n"
-            f"┠ [{bar}] {progress:.2f}%\n"
-            f"┠ ᴘʀᴏᴄᴇssᴇᴅ: {format_size(completed)} ᴏғ {format_size(total)}\n"
-            f"┠ sᴛᴀᴛᴜs: 📥 Downloading\n"
-            f"┠ ᴇɴɢɪɴᴇ: <b><u>Aria2c v1.37.0</u></b>\n"
-            f"┠ sᴘᴇᴇᴅ: {format_size(download.download_speed)}/s\n"
-            f"┠ ᴇɴɢɪɴᴇ: <b><u>Aria2c v1.37.0</u></b>\n"
-            f"┠ ᴇᴛᴀ: {download.eta} | ᴇʟᴀᴘsᴇᴅ: {elapsed_minutes}m {elapsed_seconds}s\n"
-            f"┖ ᴜsᴇʀ: <a href='tg://user?id={user_id}'>{message.from_user.first_name}</a> | ɪᴅ: {user_id}\n"
-        )
-
-        await safe_edit(status_message, status_text)
-
-    # 4) Download finished
-    if not download.files:
-        await safe_edit(status_message, "❌ Download finished but no files found.")
-        return
-
-    file_path = download.files[0].path
-    if not os.path.exists(file_path):
-        await safe_edit(status_message, "❌ Downloaded file not found on disk.")
-        return
+    tracker = ProgressTracker(status_message, user_id, message.from_user.first_name)
+
+    # 2) Small files: straight into memory, no aria2/disk round trip
+    buffer = None
+    reserved = 0
+    if MEMORY_FASTPATH_MAX and 0 < api_size <= MEMORY_FASTPATH_MAX:
+        reserve = memory_reservation(api_size)
+        if memory_budget.try_acquire(reserve):
+            buffer = await download_to_memory(media_url, reserve, tracker)
+            if buffer is None:
+                memory_budget.release(reserve)
+            else:
+                reserved = reserve
+
+    if buffer is not None:
+        file_path = None
+        media = buffer
+        display_name = buffer.name
+    else:
+        # 3) Download to disk with aria2
+        file_path = await download_with_aria2(media_url, api_size, tracker)
+        if not file_path:
+            return
 
-    file_size = os.path.getsize(file_path)
+        # 4) Normalize filename (keep original extension, fix .mp4.mkv)
+        file_path, display_name = normalize_download_path(file_path)
+        media = file_path
 
-    # Normalize filename (keep original extension, fix .mp4.mkv)
-    file_path, display_name = normalize_download_path(file_path)
+    file_size = media_size(media)
+    rate_limiter.charge(user_id, file_size)
     ext = get_extension(display_name)
 
+    # Content fingerprint: the same bytes re-shared under another link
+    # are copied from the dump instead of uploaded again.
+    try:
+        fingerprint = await asyncio.to_thread(compute_fingerprint, media)
+    except Exception as e:
+        logger.error(f"[Dedup] Fingerprint failed for {display_name}: {e}")
+        fingerprint = None
+
     caption = (
         f"✨ {display_name}\n"
         f"👤 ʟᴇᴇᴄʜᴇᴅ ʙʏ : <a href='tg://user?id={user_id}'>{message.from_user.first_name}</a>\n"
-        f"📥 ᴜsᴇʀ ʟɪɴᴋ: tg://user?id={user_id}\n\n"
+        f"📥 ᴜsᴇʀ ʟɪɴᴋ: tg://user?id={user_id}\n"
+        f"🔗 sᴏᴜʀᴄᴇ: {url}\n\n"
         "[ᴘᴏᴡᴇʀᴇᴅ ʙʏ 𝙭𝙚𝙣𝙤𝙣 ᴅᴏᴡɴʟᴏᴀᴅᴇʀ 👾](https://t.me/xenondownloader)"
     )
 
-    last_update_time = time.time()
-    UPDATE_INTERVAL = 15
-
-    async def upload_status(text: str):
-        nonlocal last_update_time
-        now = time.time()
-        if now - last_update_time >= UPDATE_INTERVAL:
-            await safe_edit(status_message, text)
-            last_update_time = now
-
-    async def upload_progress(current, total):
-        progress = (current / total) * 100 if total else 0
-        elapsed_time = datetime.now() - start_time
-        elapsed_minutes, elapsed_seconds = divmod(elapsed_time.seconds, 60)
-
-        bar_filled = int(progress / 10)
-        bar = "★" * bar_filled + "☆" * (10 - bar_filled)
-
-        text = (
-            f"┏ ғɪʟᴇɴᴀᴍᴇ: {display_name}\n"
-            f"┠ [{bar}] {progress:.2f}%\n"
-            f"┠ ᴘʀᴏᴄᴇssᴇᴅ: {format_size(current)} ᴏғ {format_size(total)}\n"
-            f"┠ sᴛᴀᴛᴜs: 📤 Uploading to Telegram\n"
-            f"┠ ᴇɴɢɪɴᴇ: <b><u>PyroFork v2.2.11</u></b>\n"
-            f"┠ sᴘᴇᴇᴅ: {format_size(current / elapsed_time.seconds if elapsed_time.seconds > 0 else 0)}/s\n"
-            f"┠ ᴇʟᴀᴘsᴇᴅ: {elapsed_minutes}m {elapsed_seconds}s\n"
-            f"┖ ᴜsᴇʀ: <a href='tg://user?id={user_id}'>{message.from_user.first_name}</a> | ɪᴅ: {user_id}\n"
-        )
-        await upload_status(text)
-
-    async def split_video_with_ffmpeg(input_path, output_prefix, split_size):
-        """
-        Split big videos into <= split_size using ffprobe + xtra (ffmpeg).
-        """
-        try:
-            original_ext = os.path.splitext(input_path)[1].lower() or ".mp4"
-            start_split = datetime.now()
-            last_progress_update = time.time()
-
-            proc = await asyncio.create_subprocess_exec(
-                "ffprobe", "-v", "error", "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1", input_path,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, _ = await proc.communicate()
-            total_duration = float(stdout.decode().strip())
-
-            file_size_local = os.path.getsize(input_path)
-            parts = math.ceil(file_size_local / split_size)
-            if parts == 1:
-                return [input_path]
-
-            duration_per_part = total_duration / parts
-            split_files = []
-
-            for i in range(parts):
-                current_time_local = time.time()
-                if current_time_local - last_progress_update >= UPDATE_INTERVAL:
-                    elapsed = datetime.now() - start_split
-                    status_text = (
-                        f"✂️ Splitting {os.path.basename(input_path)}\n"
-                        f"Part {i+1}/{parts}\n"
-                        f"Elapsed: {elapsed.seconds // 60}m {elapsed.seconds % 60}s"
-                    )
-                    await upload_status(status_text)
-                    last_progress_update = current_time_local
-
-                output_path = f"{output_prefix}.{i+1:03d}{original_ext}"
-                cmd = [
-                    "xtra", "-y", "-ss", str(i * duration_per_part),
-                    "-i", input_path, "-t", str(duration_per_part),
-                    "-c", "copy", "-map", "0",
-                    "-avoid_negative_ts", "make_zero",
-                    output_path
-                ]
-
-                proc = await asyncio.create_subprocess_exec(*cmd)
-                await proc.wait()
-                split_files.append(output_path)
-
-            return split_files
-        except Exception as e:
-            logger.error(f"Split error: {e}")
-            raise
-
-    async def send_media(uploader_client: Client, chat_id: int, path: str, cap: str):
+    async def send_media(uploader_client: Client, chat_id: int, path: str | io.BytesIO,
+                         cap: str, label: str = ""):
+        """Wait for an upload slot (smallest file first), then upload."""
+        size = media_size(path)
+        async with upload_scheduler.slot(size):
+            tracker.start_phase("upload", media_name(path), size, label)
+            if not isinstance(path, str):
+                path.seek(0)
+            return await _send_media(uploader_client, chat_id, path, cap)
+
+    async def _send_media(uploader_client: Client, chat_id: int, path: str | io.BytesIO,
+                          cap: str):
         """Send media with correct method based on extension."""
-        e = get_extension(path)
+        upload_progress = tracker.upload_progress
+        e = get_extension(media_name(path))
         if is_video_ext(e):
             return await uploader_client.send_video(
                 chat_id,
@@ -703,59 +1096,129 @@ async def handle_message(client: Client, message: Message):
                 progress=upload_progress
             )
 
-    async def send_file_to_dump_and_user(path, cap, part_info: str = ""):
+    async def copy_from_dump(message_id: int, full_caption: str) -> bool:
+        """
+        Deliver a deduplicated dump post. True if delivered, False if the
+        post is gone (its fingerprint row is stale). Any other failure
+        raises, keeping the row: the post may still be there.
+        """
+        if await deliver_from_dump(
+            message.chat.id, message_id, lookup_indexed_file_id(message_id), full_caption
+        ):
+            return True
+        if await dump_post_gone(message_id):
+            logger.warning(f"[Dedup] Dump message {message_id} is gone")
+            return False
+        raise RuntimeError(f"Could not deliver dump message {message_id}, try again later")
+
+    async def send_existing_parts(message_ids: list[int], cap: str) -> int:
+        """
+        Deliver a deduplicated file by copying its dump posts.
+        Returns 0 if every part was delivered, else the index of the first
+        part whose post is gone (its row is dropped) to resume from.
+        """
+        for idx, message_id in enumerate(message_ids, start=1):
+            part_info = f"Part {idx}/{len(message_ids)}" if len(message_ids) > 1 else ""
+            full_caption = cap + (f"\n\n{part_info}" if part_info else "")
+            if not await copy_from_dump(message_id, full_caption):
+                forget_fingerprint_part(fingerprint, idx)
+                return idx
+        logger.info(f"[Dedup] {display_name} matched {len(message_ids)} existing dump post(s)")
+        return 0
+
+    async def send_file_to_dump_and_user(path, cap, part_info: str = "",
+                                         part_index: int = 1, part_count: int = 1):
         full_caption = cap + (f"\n\n{part_info}" if part_info else "")
 
+        # 0) same content already in dump -> copy it instead of uploading
+        if fingerprint:
+            existing_id = lookup_fingerprint_part(fingerprint, part_index)
+            if existing_id and await copy_from_dump(existing_id, full_caption):
+                return
+            if existing_id:
+                forget_fingerprint_part(fingerprint, part_index)
+
         # Always prefer user client if running, else bot
         uploader = user or app
 
-        # 1) send to dump
+        # 1) upload the bytes once, to dump
         try:
-            sent = await send_media(uploader, DUMP_CHAT_ID, path, full_caption)
+            sent = await send_media(uploader, DUMP_CHAT_ID, path, full_caption, part_info)
         except RPCError as e:
             logger.error(f"BadRequest while sending to dump chat {DUMP_CHAT_ID}: {e}")
-            # fallback: send directly to user
+            # fallback: upload directly to user, then fill dump from that file_id
             try:
-                await send_media(app, message.chat.id, path, full_caption)
+                direct = await send_media(app, message.chat.id, path, full_caption, part_info)
             except Exception as e2:
                 logger.error(f"Fallback direct send failed: {e2}")
                 raise
-        else:
-            # 2) forward/copy to user
-            try:
-                await app.copy_message(
-                    chat_id=message.chat.id,
-                    from_chat_id=DUMP_CHAT_ID,
-                    message_id=sent.id,
-                    caption=full_caption
-                )
-            except Exception as e:
-                logger.warning(f"Could not forward from dump to user: {e}")
+            count_delivery("direct_upload")
+
+            _, media = get_message_media(direct)
+            if media:
                 try:
-                    await send_media(app, message.chat.id, path, full_caption)
-                except Exception as e2:
-                    logger.error(f"Final send to user failed: {e2}")
-                    raise
+                    dumped = await with_backoff("send_cached_media to dump", lambda: app.send_cached_media(
+                        DUMP_CHAT_ID, media.file_id, caption=full_caption
+                    ))
+                except Exception as e3:
+                    logger.error(f"Could not fill dump from user's file_id: {e3}")
+                    dumped = None
+                if dumped:
+                    if fingerprint:
+                        record_fingerprint(fingerprint, part_index, part_count, dumped.id)
+                    index_dump_message(dumped, url)
+            return
+
+        if fingerprint:
+            record_fingerprint(fingerprint, part_index, part_count, sent.id)
+        bot_view = await index_uploaded_message(uploader, sent, url)
+        _, media = get_message_media(bot_view)
+
+        # 2) deliver to user from dump (copy, then cached file_id);
+        #    UndeliverableError propagates: re-uploading can't help then
+        if await deliver_from_dump(
+            message.chat.id, sent.id, media.file_id if media else None, full_caption
+        ):
+            return
+
+        # 3) last resort: upload the bytes again
+        logger.warning("Could not deliver from dump to user, re-uploading")
+        count_delivery("reupload")
+        try:
+            await send_media(app, message.chat.id, path, full_caption, part_info)
+        except Exception as e2:
+            logger.error(f"Final send to user failed: {e2}")
+            raise
 
     # 5) Handle upload (with optional splitting)
     try:
-        if is_video_ext(ext) and file_size > SPLIT_SIZE:
-            await upload_status(
-                f"✂️ Splitting {display_name} ({format_size(file_size)})"
-            )
+        # Parts before resume_from were already copied from the dump
+        existing_ids = lookup_fingerprint(fingerprint) if fingerprint else None
+        resume_from = await send_existing_parts(existing_ids, caption) if existing_ids else 1
+        if resume_from == 0:
+            pass
+        elif file_path and is_video_ext(ext) and file_size > SPLIT_SIZE:
             split_files = await split_video_with_ffmpeg(
                 file_path,
                 os.path.splitext(file_path)[0],
-                SPLIT_SIZE
+                SPLIT_SIZE,
+                tracker
             )
+            if resume_from > 1 and len(split_files) != len(existing_ids):
+                logger.warning(
+                    f"[Dedup] {display_name} now splits into {len(split_files)} parts, "
+                    f"not {len(existing_ids)}; sending all parts"
+                )
+                resume_from = 1
             try:
                 for idx, part in enumerate(split_files, start=1):
-                    await upload_status(
-                        f"📤 Uploading part {idx}/{len(split_files)}\n"
-                        f"{os.path.basename(part)}"
-                    )
+                    if idx < resume_from:
+                        continue
                     part_info = f"Part {idx}/{len(split_files)}"
-                    await send_file_to_dump_and_user(part, caption, part_info)
+                    await send_file_to_dump_and_user(
+                        part, caption, part_info,
+                        part_index=idx, part_count=len(split_files)
+                    )
             finally:
                 for part in split_files:
                     try:
@@ -763,20 +1226,19 @@ async def handle_message(client: Client, message: Message):
                     except Exception:
                         pass
         else:
-            await upload_status(
-                f"📤 Uploading {display_name}\n"
-                f"Size: {format_size(file_size)}"
-            )
-            await send_file_to_dump_and_user(file_path, caption)
+            await send_file_to_dump_and_user(media, caption)
     except Exception as e:
         logger.error(f"Upload failed: {e}")
         await safe_edit(status_message, f"❌ Upload failed:\n`{e}`")
     finally:
-        if os.path.exists(file_path):
+        if file_path and os.path.exists(file_path):
             try:
                 os.remove(file_path)
             except Exception:
                 pass
+        if buffer is not None:
+            buffer.close()
+            memory_budget.release(reserved)
 
     try:
         await status_message.delete()
@@ -786,22 +1248,917 @@ async def handle_message(client: Client, message: Message):
 
 
 # -------------------------------------------------
-# Flask keep-alive
+# Content fingerprints -> dump message IDs
+# -------------------------------------------------
+def compute_fingerprint(media: str | io.BytesIO) -> str:
+    """
+    Size + SHA-256 of the content, streamed in FINGERPRINT_BLOCK reads.
+    Huge files (>= FINGERPRINT_PARTIAL_MIN_SIZE, if enabled) only hash
+    the head and tail chunks; the mode is part of the key so full and
+    partial fingerprints never collide.
+    `media` is a path or an in-memory buffer (same key for the same bytes).
+    Blocking: run it with asyncio.to_thread.
+    """
+    if not isinstance(media, str):
+        media.seek(0)
+        try:
+            return _fingerprint_stream(media, media_size(media))
+        finally:
+            media.seek(0)
+    with open(media, "rb") as f:
+        return _fingerprint_stream(f, os.path.getsize(media))
+
+
+def _fingerprint_stream(f, size: int) -> str:
+    h = hashlib.sha256()
+    if FINGERPRINT_PARTIAL_MIN_SIZE and size >= FINGERPRINT_PARTIAL_MIN_SIZE:
+        mode = "p"
+        h.update(f.read(FINGERPRINT_PARTIAL_CHUNK))
+        f.seek(max(size - FINGERPRINT_PARTIAL_CHUNK, 0))
+        h.update(f.read(FINGERPRINT_PARTIAL_CHUNK))
+    else:
+        mode = "f"
+        for block in iter(lambda: f.read(FINGERPRINT_BLOCK), b""):
+            h.update(block)
+    return f"{size}:{mode}:{h.hexdigest()}"
+
+
+def lookup_fingerprint(fingerprint: str) -> list[int] | None:
+    """Dump message IDs (in part order) if every part of this content is stored."""
+    rows = db_execute(
+        "SELECT part_index, part_count, message_id FROM fingerprints "
+        "WHERE fingerprint = ? ORDER BY part_index",
+        (fingerprint,)
+    )
+    if not rows or len(rows) != rows[0][1]:
+        return None
+    return [r[2] for r in rows]
+
+
+def lookup_fingerprint_part(fingerprint: str, part_index: int) -> int | None:
+    rows = db_execute(
+        "SELECT message_id FROM fingerprints WHERE fingerprint = ? AND part_index = ?",
+        (fingerprint, part_index)
+    )
+    return rows[0][0] if rows else None
+
+
+def record_fingerprint(fingerprint: str, part_index: int, part_count: int, message_id: int):
+    try:
+        db_execute(
+            "INSERT OR REPLACE INTO fingerprints "
+            "(fingerprint, part_index, part_count, message_id) VALUES (?, ?, ?, ?)",
+            (fingerprint, part_index, part_count, message_id)
+        )
+    except Exception as e:
+        logger.error(f"[Dedup] Failed to record fingerprint: {e}")
+
+
+def forget_fingerprint_part(fingerprint: str, part_index: int):
+    """Drop one part whose dump post is gone (deleted from the channel)."""
+    try:
+        db_execute(
+            "DELETE FROM fingerprints WHERE fingerprint = ? AND part_index = ?",
+            (fingerprint, part_index)
+        )
+    except Exception as e:
+        logger.error(f"[Dedup] Failed to forget fingerprint part: {e}")
+
+
+# -------------------------------------------------
+# Rate limiter: token bucket + concurrent jobs + daily bytes
+# -------------------------------------------------
+class RateLimiter:
+    """
+    Per-user limits, kept in memory (optionally persisted to JSON):
+      - rpm:      requests per minute, token bucket with RATE_LIMIT_BURST capacity
+      - jobs:     max concurrent jobs
+      - quota_gb: bytes downloaded per UTC day
+    ADMIN_IDS and RATE_LIMIT_EXEMPT_IDS bypass everything.
+    """
+
+    def __init__(self, state_file: str = ""):
+        self.state_file = state_file
+        self.buckets: dict[int, list[float]] = {}  # uid -> [tokens, last_refill]
+        self.active: dict[int, int] = {}
+        self.usage: dict[int, int] = {}
+        self.day = self._today()
+        self.overrides: dict[int, dict] = dict(RATE_LIMIT_OVERRIDES)
+        self._load()
+
+    @staticmethod
+    def _today() -> str:
+        return time.strftime("%Y-%m-%d", time.gmtime())
+
+    @staticmethod
+    def _format_wait(seconds: float) -> str:
+        seconds = max(int(math.ceil(seconds)), 1)
+        hours, rest = divmod(seconds, 3600)
+        minutes, secs = divmod(rest, 60)
+        if hours:
+            return f"{hours}h {minutes}m"
+        if minutes:
+            return f"{minutes}m {secs}s"
+        return f"{secs}s"
+
+    def _load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r") as f:
+                state = json.load(f)
+            if state.get("day") == self.day:
+                self.usage = {int(k): v for k, v in state.get("usage", {}).items()}
+            for k, v in state.get("overrides", {}).items():
+                self.overrides[int(k)] = v
+        except Exception as e:
+            logger.error(f"[RateLimit] Failed to load state: {e}")
+
+    def _save(self):
+        if not self.state_file:
+            return
+        try:
+            tmp = self.state_file + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({
+                    "day": self.day,
+                    "usage": self.usage,
+                    "overrides": self.overrides,
+                }, f)
+            os.replace(tmp, self.state_file)
+        except Exception as e:
+            logger.error(f"[RateLimit] Failed to save state: {e}")
+
+    def _roll_day(self):
+        today = self._today()
+        if today != self.day:
+            self.day = today
+            self.usage.clear()
+            self._save()
+
+    def is_exempt(self, uid: int) -> bool:
+        return uid in ADMIN_IDS or uid in RATE_LIMIT_EXEMPT_IDS or bool(
+            self.overrides.get(uid, {}).get("exempt")
+        )
+
+    def limits_for(self, uid: int) -> tuple[float, int, int]:
+        o = self.overrides.get(uid, {})
+        rpm = float(o.get("rpm", RATE_LIMIT_PER_MINUTE))
+        jobs = int(o.get("jobs", MAX_CONCURRENT_JOBS))
+        quota = int(float(o.get("quota_gb", DAILY_QUOTA_GB)) * 1024 ** 3)
+        return rpm, jobs, quota
+
+    def set_override(self, uid: int, limits: dict):
+        if limits:
+            self.overrides[uid] = limits
+        else:
+            self.overrides.pop(uid, None)
+        self._save()
+
+    def check_quota(self, uid: int, nbytes: int = 0) -> str | None:
+        """
+        None if `uid` may download `nbytes` more today, else the text to
+        reply with (including when the quota resets).
+        """
+        if self.is_exempt(uid):
+            return None
+        self._roll_day()
+        _, _, quota = self.limits_for(uid)
+        if not quota:
+            return None
+
+        used = self.usage.get(uid, 0)
+        over = used + nbytes > quota if nbytes else used >= quota
+        if not over:
+            return None
+
+        reset_in = 86400 - (time.time() % 86400)
+        if nbytes:
+            reason = (
+                f"📦 This file ({format_size(nbytes)}) exceeds your remaining daily quota "
+                f"({format_size(max(quota - used, 0))} left)."
+            )
+        else:
+            reason = f"📦 Daily quota reached: {format_size(used)} of {format_size(quota)} used."
+        return f"{reason}\nTry again in {self._format_wait(reset_in)}."
+
+    def acquire(self, uid: int) -> str | None:
+        """
+        Take a request token and a job slot for `uid`.
+        Returns None if allowed, else the text to reply with.
+        Every successful acquire must be paired with release().
+        """
+        if self.is_exempt(uid):
+            self.active[uid] = self.active.get(uid, 0) + 1
+            return None
+
+        rpm, jobs, _ = self.limits_for(uid)
+
+        if jobs and self.active.get(uid, 0) >= jobs:
+            return (
+                f"⏳ You already have {self.active[uid]} job(s) running "
+                f"(limit {jobs}). Try again when one finishes."
+            )
+
+        quota_error = self.check_quota(uid)
+        if quota_error:
+            return quota_error
+
+        if rpm:
+            rate = rpm / 60.0
+            capacity = max(RATE_LIMIT_BURST, 1)
+            now = time.monotonic()
+            tokens, last = self.buckets.get(uid, [capacity, now])
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens < 1:
+                self.buckets[uid] = [tokens, now]
+                return (
+                    f"🐢 Too many requests ({rpm:g}/min). "
+                    f"Try again in {self._format_wait((1 - tokens) / rate)}."
+                )
+            self.buckets[uid] = [tokens - 1, now]
+
+        self.active[uid] = self.active.get(uid, 0) + 1
+        return None
+
+    def release(self, uid: int):
+        count = self.active.get(uid, 0) - 1
+        if count > 0:
+            self.active[uid] = count
+        else:
+            self.active.pop(uid, None)
+
+    def charge(self, uid: int, nbytes: int):
+        if self.is_exempt(uid) or nbytes <= 0:
+            return
+        self._roll_day()
+        self.usage[uid] = self.usage.get(uid, 0) + nbytes
+        self._save()
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_STATE_FILE)
+
+
+# -------------------------------------------------
+# Progress tracker (download, split, upload)
+# -------------------------------------------------
+class ProgressTracker:
+    """
+    One per job, shared by every phase. Progress callbacks only call
+    update(), which is O(1): counters plus an EWMA speed sample at most
+    once per SPEED_SAMPLE_INTERVAL. The status text is rendered only in
+    maybe_edit(), when an edit of the status message is actually due.
+    """
+
+    PHASES = {
+        "download": ("📥 Downloading", "Aria2c v1.37.0"),
+        "split": ("✂️ Splitting", "FFmpeg"),
+        "upload": ("📤 Uploading to Telegram", "PyroFork v2.2.11"),
+    }
+
+    def __init__(self, status_message: Message, user_id: int, first_name: str,
+                 interval: float = STATUS_UPDATE_INTERVAL):
+        self.status_message = status_message
+        self.user_id = user_id
+        self.first_name = first_name
+        self.interval = interval
+        self.last_edit = 0.0
+        self.start_phase("download", "Unknown")
+
+    def start_phase(self, phase: str, name: str, total: int = 0, label: str = ""):
+        now = time.monotonic()
+        self.phase = phase
+        self.name = name
+        self.label = label
+        self.total = total
+        self.current = 0
+        self.phase_start = now
+        self.sample_time = now
+        self.sample_value = 0
+        self.speed = 0.0
+
+    def update(self, current: int, total: int | None = None):
+        self.current = current
+        if total:
+            self.total = total
+        now = time.monotonic()
+        dt = now - self.sample_time
+        if dt >= SPEED_SAMPLE_INTERVAL:
+            rate = max(current - self.sample_value, 0) / dt
+            self.speed = rate if not self.speed else (
+                SPEED_EWMA_ALPHA * rate + (1 - SPEED_EWMA_ALPHA) * self.speed
+            )
+            self.sample_time = now
+            self.sample_value = current
+
+    def eta(self) -> float | None:
+        if self.speed <= 0 or not self.total:
+            return None
+        return max(self.total - self.current, 0) / self.speed
+
+    def render(self) -> str:
+        status, engine = self.PHASES[self.phase]
+        progress = self.current * 100 / self.total if self.total else 0.0
+        bar_filled = min(int(progress / 10), 10)
+        bar = "★" * bar_filled + "☆" * (10 - bar_filled)
+        elapsed = format_duration(time.monotonic() - self.phase_start)
+        eta = self.eta()
+
+        if self.phase == "split":
+            processed = f"Part {self.current} ᴏғ {self.total}"
+            speed = "-"
+        else:
+            processed = f"{format_size(self.current)} ᴏғ {format_size(self.total)}"
+            speed = f"{format_size(int(self.speed))}/s"
+
+        return (
+            f"┏ ғɪʟᴇɴᴀᴍᴇ: {self.name}\n"
+            + (f"┠ {self.label}\n" if self.label else "")
+            + f"┠ [{bar}] {progress:.2f}%\n"
+            f"┠ ᴘʀᴏᴄᴇssᴇᴅ: {processed}\n"
+            f"┠ sᴛᴀᴛᴜs: {status}\n"
+            f"┠ ᴇɴɢɪɴᴇ: <b><u>{engine}</u></b>\n"
+            f"┠ sᴘᴇᴇᴅ: {speed}\n"
+            f"┠ ᴇᴛᴀ: {format_duration(eta) if eta is not None else '-'} | ᴇʟᴀᴘsᴇᴅ: {elapsed}\n"
+            f"┖ ᴜsᴇʀ: <a href='tg://user?id={self.user_id}'>{self.first_name}</a> | ɪᴅ: {self.user_id}\n"
+        )
+
+    async def maybe_edit(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_edit < self.interval:
+            return
+        self.last_edit = now
+        await safe_edit(self.status_message, self.render())
+
+    async def upload_progress(self, current: int, total: int):
+        """Pyrogram progress callback."""
+        self.update(current, total)
+        await self.maybe_edit()
+
+
+async def probe_duration(input_path: str) -> float:
+    """Container duration in seconds, via ffprobe."""
+    proc = await asyncio.create_subprocess_exec(
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", input_path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, _ = await proc.communicate()
+    return float(stdout.decode().strip())
+
+
+async def split_video_with_ffmpeg(input_path: str, output_prefix: str, split_size: int,
+                                  tracker: ProgressTracker | None = None) -> list[str]:
+    """
+    Split big videos into <= split_size using ffprobe + xtra (ffmpeg).
+    """
+    try:
+        original_ext = os.path.splitext(input_path)[1].lower() or ".mp4"
+        total_duration = await probe_duration(input_path)
+
+        file_size_local = os.path.getsize(input_path)
+        parts = math.ceil(file_size_local / split_size)
+        if parts == 1:
+            return [input_path]
+
+        duration_per_part = total_duration / parts
+        split_files = []
+        if tracker:
+            tracker.start_phase("split", os.path.basename(input_path), parts)
+
+        for i in range(parts):
+            if tracker:
+                tracker.update(i)
+                await tracker.maybe_edit()
+
+            output_path = f"{output_prefix}.{i+1:03d}{original_ext}"
+            cmd = [
+                FFMPEG_BIN, "-y", "-ss", str(i * duration_per_part),
+                "-i", input_path, "-t", str(duration_per_part),
+                "-c", "copy", "-map", "0",
+                "-avoid_negative_ts", "make_zero",
+                output_path
+            ]
+
+            proc = await asyncio.create_subprocess_exec(*cmd)
+            await proc.wait()
+            split_files.append(output_path)
+
+        return split_files
+    except Exception as e:
+        logger.error(f"Split error: {e}")
+        raise
+
+
+# -------------------------------------------------
+# Bandwidth manager (aria2) and upload scheduler
 # -------------------------------------------------
-flask_app = Flask(__name__)
+def effective_remaining(remaining: int, waited: float) -> float:
+    """Priority key: remaining bytes, discounted by how long the job has waited."""
+    return remaining / (1 + waited / BANDWIDTH_AGING_SECONDS)
 
 
-@flask_app.route("/")
-def home():
-    return render_template("index.html")
+class BandwidthManager:
+    """
+    Periodically reorders aria2's waiting queue and sets per-download
+    speed limits so the job closest to finishing gets most of the link:
+      - the job with the smallest effective remaining size is unlimited and
+        BANDWIDTH_PRIORITY_SHARE of the link capacity is reserved for it
+      - every other active job is capped to an equal part of the rest
+        (never below BANDWIDTH_MIN_RATE)
+      - if the head job ran unthrottled for a round and still leaves its
+        reserve unused (e.g. a slow server), the unused part goes to the others
+    Sizes come from aria2 once it knows them, else from the Tera API.
+    """
+
+    def __init__(self):
+        self.jobs: dict[str, dict] = {}  # gid -> {"size", "since", "limit"}
+        self.capacity = 0.0
+        self.last_head: str | None = None
+
+    def register(self, gid: str, expected_size: int = 0):
+        self.jobs[gid] = {"size": expected_size, "since": time.monotonic(), "limit": None}
+
+    def unregister(self, gid: str):
+        self.jobs.pop(gid, None)
+
+    async def _status(self, gid: str) -> dict | None:
+        try:
+            return await asyncio.to_thread(
+                aria2.client.tell_status, gid,
+                ["status", "totalLength", "completedLength", "downloadSpeed"]
+            )
+        except Exception:
+            return None
+
+    async def _set_limit(self, gid: str, job: dict, limit: int):
+        if job["limit"] == limit:
+            return
+        try:
+            await asyncio.to_thread(
+                aria2.client.change_option, gid, {"max-download-limit": str(limit)}
+            )
+            job["limit"] = limit
+        except Exception as e:
+            logger.debug(f"[Bandwidth] change_option failed for {gid}: {e}")
+
+    async def rebalance(self):
+        now = time.monotonic()
+        active, waiting = [], []
+        for gid, job in list(self.jobs.items()):
+            st = await self._status(gid)
+            if not st:
+                continue
+            total = int(st.get("totalLength") or 0) or job["size"]
+            remaining = max(total - int(st.get("completedLength") or 0), 0)
+            entry = (effective_remaining(remaining, now - job["since"]), gid, job,
+                     int(st.get("downloadSpeed") or 0))
+            if st.get("status") == "active":
+                active.append(entry)
+            elif st.get("status") == "waiting":
+                waiting.append(entry)
+
+        # Queue order among waiting downloads: shortest (aged) first
+        waiting.sort(key=lambda e: e[0])
+        for pos, (_, gid, _, _) in enumerate(waiting):
+            try:
+                await asyncio.to_thread(aria2.client.change_position, gid, pos, "POS_SET")
+            except Exception as e:
+                logger.debug(f"[Bandwidth] change_position failed for {gid}: {e}")
+
+        if len(active) <= 1:
+            for _, gid, job, _ in active:
+                await self._set_limit(gid, job, 0)
+            return
+
+        active.sort(key=lambda e: e[0])
+        link_speed = sum(e[3] for e in active)
+        self.capacity = max(link_speed, self.capacity * BANDWIDTH_CAPACITY_DECAY)
+
+        head_gid, head_speed = active[0][1], active[0][3]
+        reserved = self.capacity * BANDWIDTH_PRIORITY_SHARE
+        others_total = self.capacity - reserved
+        if head_gid == self.last_head and head_speed < reserved * 0.8:
+            others_total += reserved - head_speed
+        self.last_head = head_gid
+        others_limit = max(BANDWIDTH_MIN_RATE, int(others_total / (len(active) - 1)))
+
+        await self._set_limit(active[0][1], active[0][2], 0)
+        for _, gid, job, _ in active[1:]:
+            await self._set_limit(gid, job, others_limit)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(BANDWIDTH_REBALANCE_INTERVAL)
+            if not self.jobs:
+                continue
+            try:
+                await self.rebalance()
+            except Exception as e:
+                logger.error(f"[Bandwidth] Rebalance failed: {e}")
 
 
+class UploadScheduler:
+    """
+    Limits concurrent Telegram uploads to UPLOAD_SLOTS (0 = unlimited).
+    When a slot frees up it goes to the waiting upload with the smallest
+    aged size, the same shortest-remaining-first rule the bandwidth
+    manager uses.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = max(slots, 0)
+        self.active = 0
+        self.waiters: list[list] = []  # [size, enqueued_at, future]
+
+    def _wake(self):
+        now = time.monotonic()
+        while self.active < self.slots and self.waiters:
+            best = min(self.waiters, key=lambda w: effective_remaining(w[0], now - w[1]))
+            self.waiters.remove(best)
+            self.active += 1
+            best[2].set_result(None)
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, size: int):
+        if not self.slots:
+            yield
+            return
+        if self.active < self.slots and not self.waiters:
+            self.active += 1
+        else:
+            entry = [size, time.monotonic(), asyncio.get_running_loop().create_future()]
+            self.waiters.append(entry)
+            try:
+                await entry[2]
+            except asyncio.CancelledError:
+                if entry in self.waiters:
+                    self.waiters.remove(entry)
+                elif not entry[2].cancelled():
+                    # Slot was granted just as we got cancelled
+                    self.release()
+                raise
+        try:
+            yield
+        finally:
+            self.release()
+
+
+bandwidth_manager = BandwidthManager()
+upload_scheduler = UploadScheduler(UPLOAD_SLOTS)
+
+
+# -------------------------------------------------
+# Downloads: aria2 (disk) and in-memory fast path
+# -------------------------------------------------
+class MemoryBudget:
+    """Bytes reserved by in-memory downloads, capped at `limit`."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    def try_acquire(self, nbytes: int) -> bool:
+        if self.used + nbytes > self.limit:
+            return False
+        self.used += nbytes
+        return True
+
+    def release(self, nbytes: int):
+        self.used = max(self.used - nbytes, 0)
+
+
+memory_budget = MemoryBudget(MEMORY_FASTPATH_BUDGET)
+_http_session = None
+
+
+async def get_http_session():
+    """Shared aiohttp session, so connections are pooled across jobs."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        import aiohttp
+
+        _http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=60),
+            connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300),
+        )
+    return _http_session
+
+
+def memory_reservation(api_size: int) -> int:
+    """Budget to reserve for a small file: reported size plus slack for rounding."""
+    return min(api_size + api_size // 10 + 1024 * 1024, MEMORY_FASTPATH_MAX)
+
+
+async def download_to_memory(media_url: str, max_bytes: int,
+                             tracker: ProgressTracker) -> io.BytesIO | None:
+    """
+    Fetch a small file straight into a buffer named with the cleaned filename.
+    Returns None on any error, or if the body turns out bigger than
+    max_bytes, so the caller can fall back to aria2.
+    """
+    try:
+        session = await get_http_session()
+        async with session.get(media_url) as resp:
+            if resp.status != 200:
+                logger.warning(f"[FastPath] HTTP {resp.status}, falling back to aria2")
+                return None
+
+            length = resp.content_length or 0
+            if length > max_bytes:
+                logger.info(f"[FastPath] Body is {format_size(length)}, falling back to aria2")
+                return None
+
+            disposition = resp.content_disposition
+            name = (disposition.filename if disposition else None) or urlparse(str(resp.url)).path
+            name = clean_download_name(name) or "file"
+            tracker.name = name
+
+            buffer = io.BytesIO()
+            async for chunk in resp.content.iter_chunked(MEMORY_FASTPATH_CHUNK):
+                buffer.write(chunk)
+                if buffer.tell() > max_bytes:
+                    logger.info("[FastPath] Body larger than reported, falling back to aria2")
+                    return None
+                tracker.update(buffer.tell(), length)
+                await tracker.maybe_edit()
+    except Exception as e:
+        logger.warning(f"[FastPath] In-memory download failed, falling back to aria2: {e}")
+        return None
+
+    buffer.name = name
+    buffer.seek(0)
+    return buffer
+
+
+async def download_with_aria2(media_url: str, api_size: int,
+                              tracker: ProgressTracker) -> str | None:
+    """Download to disk with aria2. Returns the file path, or None after reporting the error."""
+    status_message = tracker.status_message
+    try:
+        await asyncio.wait_for(ARIA2_READY.wait(), ARIA2_READY_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error(f"aria2 still not ready after {ARIA2_READY_TIMEOUT:g}s, giving up on download")
+        await safe_edit(status_message, "❌ Downloader is not ready yet, please try again in a minute.")
+        return None
+
+    try:
+        download = aria2.add_uris([media_url])
+    except Exception as e:
+        logger.error(f"aria2.add_uris failed: {e}")
+        await safe_edit(status_message, f"❌ Failed to start download:\n`{e}`")
+        return None
+
+    bandwidth_manager.register(download.gid, api_size)
+    try:
+        while True:
+            await asyncio.sleep(DOWNLOAD_POLL_INTERVAL)
+            try:
+                download.update()
+            except Exception as e:
+                logger.error(f"Download update failed: {e}")
+                break
+
+            if download.is_complete:
+                break
+
+            if download.is_removed or download.status == "error":
+                logger.error(f"Download failed/removed. Status={download.status}")
+                await safe_edit(status_message, "❌ Download failed or was removed.")
+                return None
+
+            tracker.name = download.name or "Unknown"
+            tracker.update(download.completed_length or 0, download.total_length or 0)
+            await tracker.maybe_edit()
+    finally:
+        bandwidth_manager.unregister(download.gid)
+
+    if not download.files:
+        await safe_edit(status_message, "❌ Download finished but no files found.")
+        return None
+
+    file_path = download.files[0].path
+    if not os.path.exists(file_path):
+        await safe_edit(status_message, "❌ Downloaded file not found on disk.")
+        return None
+
+    return file_path
+
+
+# -------------------------------------------------
+# Delivery tiers: copy_message -> send_cached_media -> re-upload
+# -------------------------------------------------
+# How often each delivery tier fired since startup (also on /health).
+DELIVERY_STATS: Counter = Counter()
+
+
+def count_delivery(tier: str):
+    DELIVERY_STATS[tier] += 1
+    logger.info(f"[Delivery] {tier} (totals: {dict(DELIVERY_STATS)})")
+
+
+# Errors about the user's chat itself: no other tier (and no re-upload) can
+# reach it. Anything else, e.g. a 403 or PEER_ID_INVALID on the dump side of
+# copy_message, only rules out the tier that hit it.
+DESTINATION_ERROR_IDS = {
+    "USER_IS_BLOCKED",
+    "USER_DEACTIVATED",
+    "INPUT_USER_DEACTIVATED",
+}
+
+
+class UndeliverableError(Exception):
+    """The user's chat refuses messages (bot blocked, account deleted)."""
+
+
+def is_transient_error(e: Exception) -> bool:
+    """FloodWait, Telegram 5xx and network/timeout errors are worth retrying."""
+    if isinstance(e, FloodWait):
+        return True
+    if isinstance(e, RPCError):
+        return (getattr(e, "CODE", 0) or 0) >= 500
+    return isinstance(e, (OSError, TimeoutError, asyncio.TimeoutError))
+
+
+def is_destination_error(e: Exception) -> bool:
+    return isinstance(e, RPCError) and getattr(e, "ID", "") in DESTINATION_ERROR_IDS
+
+
+async def with_backoff(what: str, call):
+    """
+    Await `call()` up to DELIVERY_RETRIES times while it fails with a
+    transient error, sleeping FloodWait's value or an exponential backoff
+    between attempts. Any other error is raised at once.
+    Returns the result, or None if every attempt failed transiently.
+    """
+    delay = DELIVERY_BACKOFF
+    for attempt in range(1, DELIVERY_RETRIES + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if not is_transient_error(e):
+                raise
+            if isinstance(e, FloodWait):
+                wait = e.value
+            else:
+                wait = delay
+                delay *= 2
+            logger.warning(f"[Delivery] {what} failed (attempt {attempt}/{DELIVERY_RETRIES}): {e}")
+        if attempt < DELIVERY_RETRIES:
+            await asyncio.sleep(wait)
+    return None
+
+
+async def _delivery_tier(what: str, call):
+    """
+    One delivery tier: the result, or None to move on to the next tier.
+    Raises UndeliverableError if the user's chat refuses messages.
+    """
+    try:
+        return await with_backoff(what, call)
+    except Exception as e:
+        if is_destination_error(e):
+            count_delivery("undeliverable")
+            raise UndeliverableError(str(e)) from e
+        logger.warning(f"[Delivery] {what} failed, trying next tier: {e}")
+        return None
+
+
+async def deliver_from_dump(chat_id: int, dump_message_id: int | None,
+                            file_id: str | None, caption: str) -> bool:
+    """
+    Deliver an already-uploaded file without sending its bytes again:
+    copy the dump post, else resend it by the bot's file_id.
+    Raises UndeliverableError if `chat_id` can't receive messages, so
+    callers never fall back to re-uploading for it.
+    """
+    if dump_message_id:
+        copied = await _delivery_tier("copy_message", lambda: app.copy_message(
+            chat_id=chat_id,
+            from_chat_id=DUMP_CHAT_ID,
+            message_id=dump_message_id,
+            caption=caption
+        ))
+        if copied:
+            count_delivery("copy")
+            return True
+
+    if file_id:
+        cached = await _delivery_tier("send_cached_media", lambda: app.send_cached_media(
+            chat_id, file_id, caption=caption
+        ))
+        if cached:
+            count_delivery("cached_media")
+            return True
+
+    return False
+
+
+# Errors that mean a dump post was deleted, not just unreachable right now.
+MESSAGE_GONE_ERROR_IDS = {"MESSAGE_ID_INVALID", "MESSAGE_EMPTY"}
+
+
+async def dump_post_gone(message_id: int) -> bool:
+    """
+    True only if the dump post is definitely deleted (empty message or a
+    MESSAGE_ID_INVALID-style error). Transient failures return False, so
+    callers keep its fingerprint row.
+    """
+    try:
+        post = await with_backoff("get_messages", lambda: app.get_messages(DUMP_CHAT_ID, message_id))
+    except RPCError as e:
+        return getattr(e, "ID", "") in MESSAGE_GONE_ERROR_IDS
+    except Exception as e:
+        logger.warning(f"[Dedup] Could not check dump message {message_id}: {e}")
+        return False
+    return post is None or getattr(post, "empty", False)
+
+
+# -------------------------------------------------
+# Inline mode (answered from the local dump index)
+# -------------------------------------------------
+def build_inline_result(row: tuple):
+    message_id, file_id, media_type, title, size, source_link = row
+    result_id = str(message_id)
+    description = format_size(size) if size else media_type
+    caption = f"✨ {title}"
+
+    if media_type == "video":
+        return InlineQueryResultCachedVideo(
+            video_file_id=file_id, id=result_id, title=title,
+            description=description, caption=caption
+        )
+    if media_type == "photo":
+        return InlineQueryResultCachedPhoto(
+            photo_file_id=file_id, id=result_id, title=title,
+            description=description, caption=caption
+        )
+    if media_type == "audio":
+        return InlineQueryResultCachedAudio(
+            audio_file_id=file_id, id=result_id, caption=caption
+        )
+    return InlineQueryResultCachedDocument(
+        document_file_id=file_id, id=result_id, title=title,
+        description=description, caption=caption
+    )
+
+
+@app.on_inline_query()
+async def inline_query_handler(client: Client, inline_query: InlineQuery):
+    try:
+        offset = int(inline_query.offset or 0)
+    except ValueError:
+        offset = 0
+
+    try:
+        rows = search_dump_index(inline_query.query, INLINE_RESULTS_LIMIT, offset)
+    except Exception as e:
+        logger.error(f"[Inline] Index lookup failed: {e}")
+        rows = []
+
+    next_offset = str(offset + len(rows)) if len(rows) == INLINE_RESULTS_LIMIT else ""
+    try:
+        await inline_query.answer(
+            [build_inline_result(r) for r in rows],
+            cache_time=INLINE_CACHE_TIME,
+            next_offset=next_offset
+        )
+    except Exception as e:
+        logger.error(f"[Inline] Failed to answer inline query: {e}")
+
+
+# -------------------------------------------------
+# Flask keep-alive
+# -------------------------------------------------
 def run_flask():
+    from flask import Flask, jsonify, render_template
+
+    flask_app = Flask(__name__)
+
+    @flask_app.route("/")
+    def home():
+        return render_template("index.html")
+
+    @flask_app.route("/health")
+    def health():
+        return jsonify({
+            "ready": STARTUP_STATE["ready"],
+            "aria2_ready": STARTUP_STATE["aria2_ready"],
+            "user_client": user is not None,
+            "startup_seconds": STARTUP_TIMINGS,
+            "delivery": dict(DELIVERY_STATS),
+        }), (200 if STARTUP_STATE["ready"] else 503)
+
     flask_app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
 
 
 def keep_alive():
-    Thread(target=run_flask).start()
+    Thread(target=run_flask, daemon=True).start()
 
 
 async def start_user_client():
@@ -822,21 +2179,50 @@ async def start_user_client():
         SPLIT_SIZE = 2 * 1024 * 1024 * 1024
 
 
-def run_user():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(start_user_client())
+async def timed_step(name: str, coro):
+    t0 = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        STARTUP_TIMINGS[name] = round(time.perf_counter() - t0, 3)
 
 
-# -------------------------------------------------
-# Main
-# -------------------------------------------------
-if __name__ == "__main__":
+async def main():
+    # Health endpoint first, so the platform sees us while clients start
     keep_alive()
 
+    logger.info("Starting bot client, user client and aria2 check concurrently...")
+    t0 = time.perf_counter()
+    aria2_ok, _, _ = await asyncio.gather(
+        timed_step("aria2", wait_for_aria2(ARIA2_READY_TIMEOUT)),
+        timed_step("bot_client", app.start()),
+        timed_step("user_client", start_user_client()),
+    )
+    STARTUP_TIMINGS["startup"] = round(time.perf_counter() - t0, 3)
+    STARTUP_TIMINGS["total"] = round(time.perf_counter() - STARTUP_T0, 3)
+    STARTUP_STATE["ready"] = True
+    logger.info(
+        "Startup finished: "
+        + ", ".join(f"{k}={v:.3f}s" for k, v in STARTUP_TIMINGS.items())
+    )
+
+    if not aria2_ok:
+        asyncio.create_task(wait_for_aria2(None))
+    if BANDWIDTH_REBALANCE_INTERVAL > 0:
+        asyncio.create_task(bandwidth_manager.run())
+    asyncio.create_task(scan_dump_history())
+
+    await idle()
+
+    if _http_session is not None:
+        await _http_session.close()
     if user:
-        logger.info("Starting user client...")
-        Thread(target=run_user).start()
+        await user.stop()
+    await app.stop()
 
-    logger.info("Starting bot client...")
-    app.run()
+
+# -------------------------------------------------
+# Main
+# -------------------------------------------------
+if __name__ == "__main__":
+    app.run(main())